@@ -1,16 +1,86 @@
-import os, time, json, re, hashlib, threading, queue, datetime, uuid
+import os, time, json, re, socket, hashlib, threading, queue, datetime, uuid, zipfile
+from xml.etree import ElementTree as ET
 from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 
+# python-docx 较重且只在流式 docx 解析失败的兜底路径用到，懒加载以缩短冷启动
+HAS_DOCX = None
+Document = None
+
+def _load_docx():
+    global Document, HAS_DOCX
+    if HAS_DOCX is None:
+        try:
+            from docx import Document as _Document
+            Document = _Document
+            HAS_DOCX = True
+        except Exception:
+            HAS_DOCX = False
+    return HAS_DOCX
+
+try:
+    import msgspec
+    HAS_MSGSPEC = True
+except Exception:
+    HAS_MSGSPEC = False
+
 try:
-    from docx import Document
-    HAS_DOCX = True
+    import orjson
+    HAS_ORJSON = True
 except Exception:
-    HAS_DOCX = False
+    HAS_ORJSON = False
+
+# 热路径 JSON 编解码统一走这两个入口：装了 orjson 用 C 实现（UTF-8 直出），否则退回标准库
+if HAS_ORJSON:
+    def _dumps(o) -> str: return orjson.dumps(o).decode()
+    def _dumps_b(o) -> bytes: return orjson.dumps(o)  # SSE 帧直接用字节，省一次 UTF-8 编码
+    _loads = orjson.loads
+else:
+    def _dumps(o) -> str: return json.dumps(o, ensure_ascii=False)
+    def _dumps_b(o) -> bytes: return json.dumps(o, ensure_ascii=False).encode()
+    _loads = json.loads
+
+if HAS_MSGSPEC:
+    # 一次 C 级 decode 同时完成解析+类型校验，非法请求直接 400
+    class OptimizeIn(msgspec.Struct):
+        resume_text: str = ""
+        job_description: str = ""
+        target_title: str = ""
+        target_location: str = ""
+        target_industry: str = ""
+        model: str = ""
+
+    class _ChatMsg(msgspec.Struct):
+        content: str = ""
+
+    class _ChatChoice(msgspec.Struct):
+        message: _ChatMsg
+
+    class _ChatResp(msgspec.Struct):
+        choices: list[_ChatChoice]
+
+    _optimize_decoder = msgspec.json.Decoder(OptimizeIn)
+    _chat_decoder = msgspec.json.Decoder(_ChatResp)
 
 app = Flask(__name__)
+# 请求体上限：简历 18000 字 + JD 10000 字的 UTF-8 加 JSON 包装远小于 256KB，
+# 超大请求在 WSGI 层直接 413，避免白白跑 regex 清洗与哈希
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_CONTENT_BYTES", str(256 * 1024)))
+
+try:
+    # 只压 json/html：flask-compress 对流式响应要等生成器跑完才 flush，
+    # 压 text/event-stream 会把整条 SSE 憋成最后一口气吐出，渐进输出和心跳全失效
+    from flask_compress import Compress
+    app.config["COMPRESS_MIMETYPES"] = ["application/json", "text/html"]
+    app.config["COMPRESS_MIN_SIZE"] = 512
+    app.config["COMPRESS_STREAMS"] = False
+    Compress(app)
+except Exception:
+    pass
 
 # ------------ 环境 ------------
 LLM_API_BASE = os.getenv("LLM_API_BASE") or os.getenv("OPENAI_BASE_URL") or "https://api.deepseek.com"
@@ -19,103 +89,439 @@ DEFAULT_MODEL = os.getenv("LLM_MODEL") or os.getenv("MODEL_NAME") or "deepseek-r
 
 MAX_TOKENS_DEFAULT = int(os.getenv("MAX_TOKENS", "8000"))
 REQUEST_TIMEOUT     = int(os.getenv("REQUEST_TIMEOUT", "1200"))
+LLM_CONNECT_TIMEOUT = int(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT    = int(os.getenv("LLM_READ_TIMEOUT", str(REQUEST_TIMEOUT)))
+LLM_MAX_RETRIES     = int(os.getenv("LLM_MAX_RETRIES", "2"))
 SECTION_TIMEOUT     = int(os.getenv("SECTION_TIMEOUT", "600"))
 MAX_TEXT_CHARS      = int(os.getenv("MAX_TEXT_CHARS", "18000"))
 MAX_JD_CHARS        = int(os.getenv("MAX_JD_CHARS", "10000"))
 
 BRAND_NAME = "Alsos AI Resume"
 
+# URL 与鉴权头只在导入时拼一次，call_llm 每次引用现成常量
+LLM_URL = LLM_API_BASE.rstrip("/") + "/v1/chat/completions"
+LLM_HEADERS = {"Authorization": f"Bearer {LLM_API_KEY}", "Content-Type": "application/json"}
+
+# 多端点容灾：LLM_ENDPOINTS 配 JSON 数组 [{"base": "...", "key": "..."}] 时，
+# 连不上/5xx 自动切到下一个（兼容任意 OpenAI 风格端点）；不配则只有主端点
+def _parse_endpoints():
+    eps = []
+    try:
+        for e in json.loads(os.getenv("LLM_ENDPOINTS") or "[]"):
+            base = (e.get("base") or "").rstrip("/")
+            if not base: continue
+            eps.append((base + "/v1/chat/completions",
+                        {"Authorization": f"Bearer {e.get('key') or LLM_API_KEY}",
+                         "Content-Type": "application/json"}))
+    except Exception:
+        eps = []
+    return eps or [(LLM_URL, LLM_HEADERS)]
+
+_LLM_ENDPOINTS = _parse_endpoints()
+
+# ------------ 出站连接 ------------
+class _LowLatencyAdapter(HTTPAdapter):
+    # 关闭 Nagle：几 KB 的 JSON POST 不再等凑包（最多省 ~40ms）；keep-alive 保活复用连接
+    _SOCK_OPTS = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                  (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self._SOCK_OPTS
+        return super().init_poolmanager(*args, **kwargs)
+
+# 连接池跨线程复用：7-8 个并行 section 共享 keep-alive 连接，省掉逐次 TLS 握手；
+# 429/5xx 由 urllib3 带退避自动重试。raise_on_status=False：重试耗尽后把最终
+# 5xx 响应原样返回而不是抛 RetryError，调用方才能按状态码切换备用端点
+_adapter = _LowLatencyAdapter(
+    pool_connections=32, pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["HEAD", "GET", "POST"],
+                      raise_on_status=False))
+_session = requests.Session()
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+def _warm_llm_pool():
+    # 启动时预热一次 TLS 握手，首个真实请求直接走热连接
+    try:
+        _session.head(LLM_API_BASE, timeout=3)
+    except Exception:
+        pass
+
+threading.Thread(target=_warm_llm_pool, daemon=True).start()
+
 # ------------ 简易缓存 ------------
+# 可选 C 实现的 LRU（lru-dict）：get/set/淘汰全在 C 层一步完成
+try:
+    from lru import LRU as _CLRU
+except Exception:
+    _CLRU = None
+
 class LRUCache:
+    # OrderedDict 的单个方法调用是 C 实现、GIL 下原子；7-8 个并行 section
+    # 读缓存不再抢同一把 Python 锁，竞态只需兜住偶发的 KeyError
     def __init__(self, capacity=200):
         self.cap = capacity
-        self.lock = threading.Lock()
-        self.data = OrderedDict()
+        self.data = _CLRU(capacity) if _CLRU is not None else OrderedDict()
     def get(self, k):
-        with self.lock:
-            if k in self.data:
-                self.data.move_to_end(k)
-                return self.data[k]
+        if _CLRU is not None:
+            return self.data.get(k)
+        try:
+            self.data.move_to_end(k)
+            return self.data[k]
+        except KeyError:
             return None
     def set(self, k, v):
-        with self.lock:
-            self.data[k] = v
+        self.data[k] = v
+        if _CLRU is not None:
+            return  # LRU 自带容量淘汰
+        try:
             self.data.move_to_end(k)
-            if len(self.data) > self.cap:
+        except KeyError:
+            pass  # 刚写入的键可能已被并发淘汰
+        while len(self.data) > self.cap:
+            try:
                 self.data.popitem(last=False)
+            except KeyError:
+                break
 
 cache = LRUCache(200)
+# 预分析结果也记住：同一份简历换 mode/职位重跑时这部分直接复用
+pre_cache = LRUCache(512)
+
+# L2：配置 REDIS_URL 时多 worker/多副本共享命中，重启不清缓存；未配置则只有进程内 L1
+try:
+    import redis as _redis_mod
+except Exception:
+    _redis_mod = None
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", "86400"))
+_REDIS_PREFIX = "airesume:"
+_redis = None
+if _redis_mod is not None and os.getenv("REDIS_URL"):
+    try:
+        _redis = _redis_mod.Redis.from_url(os.getenv("REDIS_URL"), decode_responses=False,
+                                           socket_connect_timeout=1, socket_timeout=1)
+    except Exception:
+        _redis = None
+
+# 没配 Redis 时退而求其次：diskcache 落本地盘，重启不丢、单机多 worker 共享
+_disk = None
+if _redis is None:
+    try:
+        import diskcache as _diskcache_mod
+        _disk = _diskcache_mod.Cache(os.getenv("DISK_CACHE_DIR", "/tmp/airesume-cache"),
+                                     size_limit=256 * 2**20)
+    except Exception:
+        _disk = None
+
+def cache_get(ck):
+    v = cache.get(ck)
+    if v is not None:
+        return v
+    raw = None
+    if _redis is not None:
+        try:
+            raw = _redis.get(_REDIS_PREFIX + ck)
+        except Exception:
+            return None
+    elif _disk is not None:
+        try:
+            raw = _disk.get(ck)
+        except Exception:
+            return None
+    if raw:
+        try:
+            v = (_loads(raw).get("data"), raw)
+        except Exception:
+            return None
+        cache.set(ck, v)  # 回填 L1
+        return v
+    return None
+
+def cache_set(ck, v):
+    cache.set(ck, v)
+    if _redis is not None:
+        try:
+            _redis.setex(_REDIS_PREFIX + ck, CACHE_TTL, v[1])
+        except Exception:
+            pass
+    elif _disk is not None:
+        try:
+            _disk.set(ck, v[1], expire=CACHE_TTL)
+        except Exception:
+            pass
+
+# 单飞（single-flight）：同一 ck 的并发未命中只有领跑者真正调 LLM，
+# 其余等事件后直接读缓存，不把同一份简历的钱花两遍
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# ------------ 上游限流 ------------
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # 每分钟请求配额，0 表示不限
+
+class TokenBucket:
+    def __init__(self, rate_per_min):
+        self.rate = rate_per_min / 60.0
+        self.capacity = float(max(1, rate_per_min))
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+    def acquire(self):
+        # 突发请求按配额平滑放行，把上游 429+重试的毛刺换成稳定排队
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_llm_sem = threading.Semaphore(LLM_MAX_CONCURRENCY)
+_llm_bucket = TokenBucket(LLM_RPM) if LLM_RPM > 0 else None
+
+# 全局常驻线程池：所有请求的 section 任务复用同一批线程，
+# 不再每个请求建/销一个 ThreadPoolExecutor（高峰期每分钟上千次线程创建）
+_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_POOL_SIZE", "32")),
+                           thread_name_prefix="llm")
 
 # ------------ 工具 ------------
+# 热路径正则统一在导入时编译：省掉 re 模块每次调用的缓存查找/加锁
+_RE_MULTINL   = re.compile(r"\n{3,}")
+_RE_HSPACE    = re.compile(r"[ \t]+")
+_RE_EN_WORDS  = re.compile(r"[A-Za-z]+")
+_RE_FENCE     = re.compile(r"^```(?:json)?\s*|\s*```$", re.I)
+
 def clean_text(s: str) -> str:
     if not s: return ""
+    # 已规范的文本（多为前端清洗过或二次调用）直接返回，跳过三趟替换
+    if "\r" not in s and "\t" not in s and "  " not in s and "\n\n\n" not in s:
+        return s.strip()
     s = s.replace("\r", "\n")
-    s = re.sub(r"\n{3,}", "\n\n", s)
-    s = re.sub(r"[ \t]+", " ", s)
+    s = _RE_MULTINL.sub("\n\n", s)
+    s = _RE_HSPACE.sub(" ", s)
     return s.strip()
 
 def truncate(s: str, limit: int) -> str:
     return (s or "")[:limit]
 
-def compress_context(s: str, hard_limit: int) -> str:
+def compress_context(s: str, hard_limit: int, head_ratio: float = 0.55) -> str:
+    # 超限时保头+保尾、丢中段：简历的开头（个人信息/摘要）和结尾（近期经历）信号最足，
+    # 纯前缀截断会把最近的工作经历整段切掉
     if not s: return ""
-    return clean_text(s)[:hard_limit]
+    s = clean_text(s)
+    if len(s) <= hard_limit: return s
+    marker = "\n…[中段省略]…\n"
+    head_n = int((hard_limit - len(marker)) * head_ratio)
+    tail_n = hard_limit - len(marker) - head_n
+    head, tail = s[:head_n], s[-tail_n:]
+    # 尽量在段落边界收口，避免半句话悬空
+    cut = head.rfind("\n")
+    if cut > head_n * 0.6: head = head[:cut]
+    cut = tail.find("\n")
+    if 0 <= cut < tail_n * 0.4: tail = tail[cut+1:]
+    return head + marker + tail
 
 def is_text_too_short(s: str) -> bool:
     if not s: return True
-    en_words = len(re.findall(r"[A-Za-z]+", s))
-    return not (len(s) >= 500 or en_words >= 300)
+    if len(s) >= 500: return False  # 长度达标直接放行，整段正则扫描只在短文本上兜底
+    return sum(1 for _ in _RE_EN_WORDS.finditer(s)) < 300
+
+_DOCX_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
 
 def read_docx(file_storage) -> str:
-    if not HAS_DOCX: return ""
+    # 流式扫 word/document.xml：不建整棵 DOM，凑够 MAX_TEXT_CHARS 立即提前返回，
+    # 大文档的内存峰值和解析时间都只按用得上的部分付费
+    try:
+        parts, total = [], 0
+        with zipfile.ZipFile(file_storage) as z, z.open("word/document.xml") as x:
+            for _, elem in ET.iterparse(x):
+                if elem.tag == _DOCX_NS + "p":
+                    t = "".join(n.text or "" for n in elem.iter(_DOCX_NS + "t"))
+                    if t:
+                        parts.append(t); total += len(t) + 1
+                        if total >= MAX_TEXT_CHARS: break
+                    elem.clear()
+        return "\n".join(parts)
+    except Exception:
+        pass
+    # 兜底：python-docx 整文档解析
+    if not _load_docx(): return ""
     try:
+        file_storage.seek(0)
         doc = Document(file_storage)
         return "\n".join(p.text for p in doc.paragraphs)
     except Exception:
         return ""
 
+_JSON_DECODER = json.JSONDecoder()
+
 def _extract_json(text: str):
     if not text:
         raise ValueError("空响应")
-    txt = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip(), flags=re.I)
+    txt = text.strip()
+    # json_object 模式下响应就是裸 JSON：直接解析，围栏清洗只留给不规范输出
+    if txt.startswith("{"):
+        try:
+            return _loads(txt)
+        except Exception:
+            pass
+    txt = _RE_FENCE.sub("", txt)
     try:
-        return json.loads(txt)
+        return _loads(txt)
     except Exception:
         pass
-    m = re.search(r"\{.*\}", txt, re.S)
-    if not m:
+    # 兜底：从第一个 { 起 raw_decode，线性一遍、天然支持嵌套，
+    # 不再用 {.*} 这种会在长响应上整段回溯的贪婪正则
+    start = txt.find("{")
+    if start < 0:
+        raise ValueError("未找到有效 JSON")
+    try:
+        return _JSON_DECODER.raw_decode(txt, start)[0]
+    except Exception:
         raise ValueError("未找到有效 JSON")
-    return json.loads(m.group(0))
 
-def call_llm(payload, json_mode=True):
+def call_llm(payload, json_mode=True, read_timeout=None):
     if not payload.get("model"):
         raise RuntimeError("缺少模型参数")
-    url = LLM_API_BASE.rstrip("/") + "/v1/chat/completions"
     if json_mode:
         payload["response_format"] = {"type": "json_object"}
-    headers = {"Authorization": f"Bearer {LLM_API_KEY}", "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
-    if r.status_code >= 400:
-        raise RuntimeError(f"LLM API 错误：{r.status_code} {r.text[:250]}")
-    return r.json()["choices"][0]["message"]["content"]
+    # 超时/断连本地带退避重试：LLM 尾延迟重，短超时+一次重试通常优于单次长等
+    read_timeout = read_timeout or LLM_READ_TIMEOUT
+    last_err = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(0.5 * (2 ** (attempt - 1)))
+            read_timeout = int(read_timeout * 1.5)
+        # 重试时轮换端点：主端点抖动/限流不拖死整次请求
+        url, headers = _LLM_ENDPOINTS[attempt % len(_LLM_ENDPOINTS)]
+        try:
+            with _llm_sem:
+                if _llm_bucket: _llm_bucket.acquire()
+                r = _session.post(url, headers=headers, json=payload,
+                                  timeout=(LLM_CONNECT_TIMEOUT, read_timeout))
+        except (requests.Timeout, requests.ConnectionError) as e:
+            last_err = e
+            continue
+        if (r.status_code == 429 or r.status_code >= 500) \
+                and len(_LLM_ENDPOINTS) > 1 and attempt < LLM_MAX_RETRIES:
+            last_err = RuntimeError(f"LLM API 错误：{r.status_code} {r.text[:250]}")
+            continue
+        if r.status_code >= 400:
+            raise RuntimeError(f"LLM API 错误：{r.status_code} {r.text[:250]}")
+        if HAS_MSGSPEC:
+            return _chat_decoder.decode(r.content).choices[0].message.content
+        return _loads(r.content)["choices"][0]["message"]["content"]
+    raise RuntimeError(f"LLM API 请求失败（重试 {LLM_MAX_RETRIES} 次）：{last_err}")
+
+def call_llm_stream(payload, on_delta=None, read_timeout=None):
+    # 流式读取上游：边收 token 边回调，TTFB 从整段生成时长降到首 token 时长
+    if not payload.get("model"):
+        raise RuntimeError("缺少模型参数")
+    payload = dict(payload)
+    payload["stream"] = True
+    payload["response_format"] = {"type": "json_object"}
+    # 信号量覆盖整个流式读取：上游生成贯穿 body 读完为止，只罩住 POST 头返回
+    # 会让 LLM_MAX_CONCURRENCY 形同虚设
+    with _llm_sem:
+        r = None; last_err = None
+        for url, headers in _LLM_ENDPOINTS:
+            try:
+                if _llm_bucket: _llm_bucket.acquire()
+                r = _session.post(url, headers=headers, json=payload,
+                                  timeout=(LLM_CONNECT_TIMEOUT, read_timeout or LLM_READ_TIMEOUT), stream=True)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                last_err = e; r = None; continue
+            if (r.status_code == 429 or r.status_code >= 500) and len(_LLM_ENDPOINTS) > 1:
+                last_err = RuntimeError(f"LLM API 错误：{r.status_code} {r.text[:250]}")
+                r.close(); r = None; continue
+            break
+        if r is None:
+            raise RuntimeError(f"LLM API 请求失败（所有端点不可用）：{last_err}")
+        if r.status_code >= 400:
+            body = r.text[:250]
+            r.close()
+            raise RuntimeError(f"LLM API 错误：{r.status_code} {body}")
+        parts = []
+        try:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"): continue
+                chunk = line[5:].strip()
+                if chunk == "[DONE]": break
+                try:
+                    delta = _loads(chunk)["choices"][0].get("delta", {}).get("content") or ""
+                except Exception:
+                    continue
+                if delta:
+                    parts.append(delta)
+                    if on_delta: on_delta(delta)
+        finally:
+            r.close()
+        return "".join(parts)
+
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
 
 def make_payload(messages, model, temperature=0.25, max_tokens=MAX_TOKENS_DEFAULT):
     return {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
 
+# ------------ ATS 本地关键词比对 ------------
+_ASCII_TOKEN_RE = re.compile(r"[A-Za-z][A-Za-z0-9+.#-]*")
+_CJK_RUN_RE     = re.compile(r"[一-鿿]+")
+
+def _keyword_set(text: str):
+    # 英文按词切；中文没有空格分词，整段连写按双字 bigram 切
+    # （"招聘体系搭建"→招聘/聘体/体系/系搭/搭建），否则整句算一个"关键词"，
+    # 中文简历的 coverage 恒为 0、gap 里全是句子片段
+    kws = {t.lower() for t in _ASCII_TOKEN_RE.findall(text) if len(t) > 1}
+    for run in _CJK_RUN_RE.findall(text):
+        kws.update(run[i:i+2] for i in range(len(run) - 1))
+    return kws
+
+def ats_keyword_overlap(resume_text: str, jd_text: str):
+    # 关键词交并集是纯集合运算，本地算掉既省一截输出 token，分数也可复现
+    resume_kw = _keyword_set(resume_text)
+    jd_kw     = _keyword_set(jd_text)
+    overlap = sorted(resume_kw & jd_kw)
+    gap     = sorted(jd_kw - resume_kw)
+    coverage = round(len(overlap) / max(len(jd_kw), 1), 3)
+    return {"overlap_keywords": overlap[:30], "gap_keywords": gap[:30],
+            "keyword_coverage": coverage}
+
 # ------------ 预分析：年限/跳槽/教育/管理/ JD 诉求 ------------
 LEVEL_ORDER = {"Junior":0, "Middle":1, "Senior":2, "Executive":3}
 
+# 预分析对全文逐个信号扫描，正则同样在导入时编译一次，请求里只做匹配
+_RE_YEAR     = re.compile(r"(?:19|20)\d{2}")
+_RE_RANGE    = re.compile(r"(20\d{2})(?:[./-]\d{1,2})?\s*[-–~]\s*(20\d{2})")
+_RE_PHD      = re.compile(r"博士|phd", re.I)
+_RE_MASTER   = re.compile(r"硕士|master", re.I)
+_RE_MGMT_NUM = re.compile(r"(?:带领|管理|负责人|lead|led|managed|manager of|direct reports)\D*(\d{1,3})", re.I)
+_RE_MGMT     = re.compile(r"管理|带领|团队|leader|lead|managed|head of|负责人", re.I)
+_RE_ELITE    = re.compile(r"985|211|双一流|qs|top ?(?:100|200)", re.I)
+_RE_JD_ELITE = re.compile(r"985|211|双一流|qs ?(top)? ?(100|200)|top ?(100|200)", re.I)
+_RE_JD_FLOOR = re.compile(r"qs ?top ?(100|200)", re.I)
+_RE_SENIOR   = re.compile(r"vp|chief|合伙人|hrvp|总监|director|head|hrd", re.I)
+_RE_EXEC     = re.compile(r"vp|vice president|chief|cxo|合伙人|partner", re.I)
+
 def _guess_year_span(text: str):
     now = datetime.datetime.utcnow().year
-    yrs = [int(y) for y in re.findall(r"(19|20)\d{2}", text)]
-    yrs = [y if y>1900 else 2000 for y in yrs]
-    yrs = [y for y in yrs if 1980 <= y <= now]
-    if not yrs: return 0
-    return max(1, min(40, max(yrs)-min(yrs)+1))
+    # 单遍扫描维护最小/最大年份，不再建中间列表
+    lo, hi = 0, 0
+    for m in _RE_YEAR.finditer(text):
+        y = int(m.group())
+        if 1980 <= y <= now:
+            if lo == 0 or y < lo: lo = y
+            if y > hi: hi = y
+    if not hi: return 0
+    return max(1, min(40, hi - lo + 1))
 
 def _hop_signal(text: str):
     # 粗略：统计形如 2018-2020 / 2018.09-2020.06 / 2018/2020 这种区段数
-    ranges = re.findall(r"(20\d{2})(?:[./-]\d{1,2})?\s*[-–~]\s*(20\d{2})", text)
+    ranges = _RE_RANGE.findall(text)
     total = len(ranges)
     # 近5年切片（粗略把包含近5年的区段计数）
     now = datetime.datetime.utcnow().year
@@ -132,27 +538,26 @@ def _hop_signal(text: str):
             "hop_suspect": hop_suspect, "stability_plus": stability_plus}
 
 def _edu_signal(text: str):
-    t = text.lower()
-    elite = any(k in t for k in ["985","211","双一流","qs","top 100","top100","top 200","top200"])
+    # 单次合并扫描代替逐关键词 in：不再为大小写复制整段文本
+    elite = bool(_RE_ELITE.search(text))
     edu_level = "bachelor"
-    if re.search(r"博士|phd", text, re.I): edu_level="phd"
-    elif re.search(r"硕士|master", text, re.I): edu_level="master"
+    if _RE_PHD.search(text): edu_level="phd"
+    elif _RE_MASTER.search(text): edu_level="master"
     return {"elite": elite, "edu_level": edu_level}
 
 def _mgmt_signal(text: str):
-    t = text.lower()
-    num = re.search(r"(?:带领|管理|负责人|lead|led|managed|manager of|direct reports)\D*(\d{1,3})", text, re.I)
-    mgmt = bool(re.search(r"管理|带领|团队|leader|lead|managed|head of|负责人", text, re.I))
+    num = _RE_MGMT_NUM.search(text)
+    mgmt = bool(_RE_MGMT.search(text))
     span = int(num.group(1)) if num else 0
     return {"mgmt": mgmt, "mgmt_span": span, "mgmt_suspect": (not mgmt or span==0)}
 
 def _jd_require(jd: str):
     if not jd: return {"need_phd": False, "need_master": False, "need_elite": False, "elite_floor": None}
-    need_phd   = bool(re.search(r"博士|phd", jd, re.I))
-    need_master= bool(re.search(r"硕士|master", jd, re.I))
-    elite = bool(re.search(r"985|211|双一流|qs ?(top)? ?(100|200)|top ?(100|200)", jd, re.I))
+    need_phd   = bool(_RE_PHD.search(jd))
+    need_master= bool(_RE_MASTER.search(jd))
+    elite = bool(_RE_JD_ELITE.search(jd))
     floor = None
-    m = re.search(r"qs ?top ?(100|200)", jd, re.I)
+    m = _RE_JD_FLOOR.search(jd)
     if m: floor = int(m.group(1))
     return {"need_phd":need_phd, "need_master":need_master, "need_elite":elite, "elite_floor":floor}
 
@@ -163,7 +568,7 @@ def quick_pre_analyze(resume_text: str, jd_text: str):
     mg  = _mgmt_signal(resume_text)
     jd  = _jd_require(jd_text)
     # level anchor（更稳健）
-    if edu["edu_level"]=="phd" or re.search(r"vp|chief|合伙人|hrvp|总监|director|head|hrd", resume_text, re.I):
+    if edu["edu_level"]=="phd" or _RE_SENIOR.search(resume_text):
         anchor="Senior"
     elif span>=6:
         anchor="Middle"
@@ -172,7 +577,7 @@ def quick_pre_analyze(resume_text: str, jd_text: str):
     else:
         anchor="Junior"
     # 若出现 VP / Chief / 合伙人，直接 Executive 候选
-    if re.search(r"vp|vice president|chief|cxo|合伙人|partner", resume_text, re.I):
+    if _RE_EXEC.search(resume_text):
         anchor="Executive"
     return {
         "years_span_estimate": span,
@@ -188,25 +593,47 @@ def quick_pre_analyze(resume_text: str, jd_text: str):
 def _fallback_from_raw(raw: str, section: str):
     return {"_raw_preview": (raw or "")[:1000], "_note": "解析失败，展示原文片段供参考。"}
 
+# 按 section 查表兜底，替换逐个 if 比较；默认值在 miss 时才构造（可变对象不能跨请求共享）
+def _d_summary(o):
+    o.setdefault("summary", "（待补充）")
+    o.setdefault("highlights", ["（待补充）"])
+
+def _d_improvements(o):
+    arr = o.setdefault("resume_improvements", [])
+    if not arr: arr.append({"issue":"（待补充）","fix":"补充可执行动作","why":"补充原因"})
+
+def _d_diagnosis(o):
+    o.setdefault("career_diagnosis", [])
+
+def _d_level(o):
+    o.setdefault("career_level_analysis", {"level":"-","reason":"（待补充）","path":[],"interview_focus":{}})
+
+def _d_strategy(o):
+    o.setdefault("strategy", {"assumptions":"（待补充）","short_term":[],"mid_term":[],"long_term":[]})
+
+def _d_interview(o):
+    o.setdefault("interview_handbook", {"answer_logic":[],"interviewer_focus":{},"star_sets":[],"risk_mitigation":[]})
+
+def _d_ats(o):
+    o.setdefault("ats", {"enabled": False})
+
+def _d_salary(o):
+    o.setdefault("salary_insights", {"title":"","city":"","currency":"CNY","low":0,"mid":0,"high":0,"factors":[],"notes":"模型估算，供参考"})
+
+_DEFAULTERS = {
+    "summary_highlights": _d_summary,
+    "improvements": _d_improvements,
+    "career_diagnosis": _d_diagnosis,
+    "career_level": _d_level,
+    "personalized_strategy": _d_strategy,
+    "interview": _d_interview,
+    "ats": _d_ats,
+    "salary": _d_salary,
+}
+
 def _ensure_nonempty(section: str, obj: dict):
-    if section == "summary_highlights":
-        obj.setdefault("summary", "（待补充）")
-        obj.setdefault("highlights", ["（待补充）"])
-    if section == "improvements":
-        arr = obj.setdefault("resume_improvements", [])
-        if not arr: arr.append({"issue":"（待补充）","fix":"补充可执行动作","why":"补充原因"})
-    if section == "career_diagnosis":
-        obj.setdefault("career_diagnosis", [])
-    if section == "career_level":
-        obj.setdefault("career_level_analysis", {"level":"-","reason":"（待补充）","path":[],"interview_focus":{}})
-    if section == "personalized_strategy":
-        obj.setdefault("strategy", {"assumptions":"（待补充）","short_term":[],"mid_term":[],"long_term":[]})
-    if section == "interview":
-        obj.setdefault("interview_handbook", {"answer_logic":[],"interviewer_focus":{},"star_sets":[],"risk_mitigation":[]})
-    if section == "ats":
-        obj.setdefault("ats", {"enabled": False})
-    if section == "salary":
-        obj.setdefault("salary_insights", {"title":"","city":"","currency":"CNY","low":0,"mid":0,"high":0,"factors":[],"notes":"模型估算，供参考"})
+    fn = _DEFAULTERS.get(section)
+    if fn: fn(obj)
     return obj
 
 # ------------ 页面 ------------
@@ -221,70 +648,60 @@ def extract_text():
     f = request.files["file"]
     name = (f.filename or "").lower()
     if name.endswith(".txt"):
-        text = f.read().decode("utf-8", errors="ignore")
-    elif name.endswith(".docx") and HAS_DOCX:
+        # 只读取用得上的前缀：MAX_TEXT_CHARS 个字符按 UTF-8 至多 4 字节，超出部分根本不进内存
+        raw = f.stream.read(MAX_TEXT_CHARS * 4 + 1024)
+        text = raw.decode("utf-8", errors="ignore")[:MAX_TEXT_CHARS]
+    elif name.endswith(".docx"):
         text = read_docx(f)
     else:
         return jsonify({"ok": False, "error": "仅支持 .txt / .docx"}), 400
     return jsonify({"ok": True, "text": clean_text(text)})
 
 # ------------ 模型路由（平衡提速） ------------
-def model_for(section: str, mode: str):
-    if mode in ("speed","fast"): return "deepseek-chat", 2600
-    if mode == "balanced":
-        if section in ["personalized_strategy","interview","career_diagnosis","career_level"]:
-            return "deepseek-reasoner", 5200
-        return "deepseek-chat", 2400
-    return "deepseek-reasoner", 7200
-
-# ------------ 主流程（SSE 流式） ------------
-@app.route("/optimize_stream", methods=["POST"])
-def optimize_stream():
-    t0 = time.time()
-    data = request.get_json(force=True) or {}
-    resume_text     = compress_context(truncate(data.get("resume_text",""), MAX_TEXT_CHARS), 9000)
-    job_description = compress_context(truncate(data.get("job_description",""), MAX_JD_CHARS), 6000)
-    target_title    = clean_text(data.get("target_title",""))
-    target_location = clean_text(data.get("target_location",""))
-    target_industry = clean_text(data.get("target_industry",""))
-    mode = (data.get("model") or "").strip().lower()
+# 结构化抽取类 section（概览/改进点/ATS/薪酬）不吃链式思考收益，
+# 深度模式下也走 deepseek-chat，reasoner 只留给真正的推理型 section
+FAST_SECTIONS = {"summary_highlights","improvements","ats","salary"}
 
-    if mode in ("speed","fast","balanced"):
-        resume_text = compress_context(resume_text, 6500)
-        job_description = compress_context(job_description, 4500)
+# 各 section 输出体量差异很大（salary 几百 token、interview 数千），
+# 统一的大预算既多花钱又拖慢收尾，按 section 封顶
+_SECTION_MAX_TOKENS = {
+    "summary_highlights": 900,
+    "improvements": 1600,
+    "career_diagnosis": 1000,
+    "career_level": 1200,
+    "personalized_strategy": 2200,
+    "interview": 4096,
+    "ats": 1800,
+    "salary": 500,
+}
 
-    if not LLM_API_KEY:
-        return jsonify({"ok": False, "error": "未配置 LLM API key"}), 500
-    if not resume_text:
-        return jsonify({"ok": False, "error": "请粘贴简历文本或上传文件"}), 400
-    if is_text_too_short(resume_text):
-        return jsonify({"ok": False, "error": "简历文本过短（≥500 中文字符或 ≥300 英文词）"}), 400
-
-    pre = quick_pre_analyze(resume_text, job_description)
-    has_jd = bool(job_description)
-
-    base_user = {
-        "resume_text": resume_text,
-        "job_description": job_description,
-        "target_title": target_title,
-        "target_location": target_location,
-        "target_industry": target_industry,
-        "pre_analysis": pre
-    }
+def model_for(section: str, mode: str):
+    if mode in ("speed","fast"):
+        model, budget = "deepseek-chat", 2600
+    elif mode == "balanced":
+        if section in ["personalized_strategy","interview","career_diagnosis","career_level"]:
+            model, budget = "deepseek-reasoner", 5200
+        else:
+            model, budget = "deepseek-chat", 2400
+    elif section in FAST_SECTIONS:
+        model, budget = "deepseek-chat", 3000
+    else:
+        model, budget = "deepseek-reasoner", 7200
+    return model, min(budget, _SECTION_MAX_TOKENS.get(section, budget))
 
-    # ------------ 更克制的 Prompts（限长 + 条件输出） ------------
-    prompts = {
-        "summary_highlights": f"""你是"{BRAND_NAME}"的资深猎头。输出紧凑 JSON（中文）：
+# ------------ 更克制的 Prompts（限长 + 条件输出；只依赖 BRAND_NAME，导入时构建一次） ------------
+PROMPTS = {
+    "summary_highlights": f"""你是"{BRAND_NAME}"的资深猎头。输出紧凑 JSON（中文）：
 {{"summary":"<120-160字职业概要>","highlights":["…"]}}
 - 语气温和专业，禁止空话；
 - highlights ≤ 6 条，每条 16-36 字，含“动作+结果(数值/规模)”；
 - 若 pre_analysis.hop.stability_plus 为真，summary 中明确“稳定性强”；""",
 
-        "improvements": """输出紧凑 JSON（中文）：
+    "improvements": """输出紧凑 JSON（中文）：
 {"resume_improvements":[{"issue":"","fix":"","why":""}, ...]}
 - 仅给“最重要的 Top6”改进点；每项为何≤30字，fix 可执行；""",
 
-        "career_diagnosis": """仅在证据成立时输出。紧凑 JSON（中文）：
+    "career_diagnosis": """仅在证据成立时输出。紧凑 JSON（中文）：
 {"career_diagnosis":[{"issue":"","risk":"","advice":""}, ...]}
 规则：
 - “跳槽频繁”仅当 pre_analysis.hop.hop_suspect 为真（近5年≥3次）才出现；建议先稳定 2-3 年并拿到量化成果；
@@ -293,7 +710,7 @@ def optimize_stream():
 - 管理跨度：仅当 pre_analysis.mgmt.mgmt_suspect 为真时出现；否则不提；
 - 每条 ≤ 40 字，总数 3-6 条；""",
 
-        "career_level": """输出 JSON（中文）：
+    "career_level": """输出 JSON（中文）：
 {"career_level_analysis":{
   "level":"Junior|Middle|Senior|Executive",
   "reason":"≤40字",
@@ -304,7 +721,7 @@ def optimize_stream():
 - 若稳定性强或管理跨度小，reason 简短点出；
 - path ≤3 条、每条 ≤ 20 字；interview_focus 各 ≤4 条；""",
 
-        "personalized_strategy": """输出 JSON（中文）：
+    "personalized_strategy": """输出 JSON（中文）：
 {"strategy":{
   "assumptions":"≤60字",
   "short_term":["现状评估(命中项)","技能/证书补齐","风险规避(若跳槽频繁给统一叙述模板)","3-6个月小目标(量化)"],
@@ -314,61 +731,211 @@ def optimize_stream():
 }}
 - 每列 3-5 条，禁止空话，条目≤24字；""",
 
-        "interview": """输出 JSON（中文）：
+    "interview": """输出 JSON（中文）：
 {"interview_handbook":{
   "level":"Junior|Middle|Senior|Executive",
   "answer_logic":["…","…","…","…","…"],
   "interviewer_focus":{"HR":["…"],"hiring_manager":["…"],"executive":["…"]},
   "star_sets":[
-    {"project_title":"","question":"","how_to_answer":["…","…","…"]},
-    {"project_title":"","question":"","how_to_answer":["…","…","…"]},
-    {"project_title":"","question":"","how_to_answer":["…","…","…"]}
+{"project_title":"","question":"","how_to_answer":["…","…","…"]},
+{"project_title":"","question":"","how_to_answer":["…","…","…"]},
+{"project_title":"","question":"","how_to_answer":["…","…","…"]}
   ],
   "risk_mitigation":[
-    "若跳槽频繁：统一解释模板……",
-    "若履历断层：正面叙述……+ 复位动作……",
-    "若教育不达标：以成果/作品集弥补……"
+"若跳槽频繁：统一解释模板……",
+"若履历断层：正面叙述……+ 复位动作……",
+"若教育不达标：以成果/作品集弥补……"
   ]
 }}
 - 仅生成对应 level；每条尽量 ≤ 26 字；""",
 
-        "ats": """输出 JSON（中文）：
+    "ats": """输出 JSON（中文）：
 {"ats":{"enabled":true,"total_score":0,"sub_scores":{"skills":0,"experience":0,"education":0,"keywords":0},
  "reasons":{"skills":["…"],"experience":["…"],"education":["…"],"keywords":["…"]},
  "gap_keywords":["…"],"improvement_advice":["…"]}}
+- 输入 ats_local 已本地算好 overlap/gap/coverage（中文按双字粒度统计）：keywords 子分以 coverage 为基准；gap_keywords 参考 ats_local.gap_keywords，把双字片段还原成完整关键词再输出；
 - reasons 各 ≤3 条；gap_keywords ≤10；advice ≤6 条；""",
 
-        "salary": """输出 JSON（中文）：
+    "salary": """输出 JSON（中文）：
 {"salary_insights":{"title":"","city":"","currency":"CNY","low":0,"mid":0,"high":0,"factors":["…"],"notes":"模型估算，供参考"}}
 - low < mid < high；factors ≤5 条；"""
+}
+
+# 草稿与精修合并为一次调用：先自检规则/条数下限，再输出最终 JSON，省掉第二轮 RPC
+_self_audit = "\n- 输出前对照上述规则与条数要求自检一遍，只输出最终 JSON；"
+PROMPTS = {k: v + _self_audit for k, v in PROMPTS.items()}
+
+# ------------ 主流程（SSE 流式） ------------
+@app.route("/optimize_stream", methods=["POST"])
+def optimize_stream():
+    t0 = time.time()
+    if HAS_MSGSPEC:
+        try:
+            o = _optimize_decoder.decode(request.get_data() or b"{}")
+        except msgspec.DecodeError:
+            return jsonify({"ok": False, "error": "请求体不是合法 JSON"}), 400
+        data = {"resume_text": o.resume_text, "job_description": o.job_description,
+                "target_title": o.target_title, "target_location": o.target_location,
+                "target_industry": o.target_industry, "model": o.model}
+    else:
+        # 跳过 werkzeug get_json 的 mimetype 检查/二次拷贝，直接对原始字节解码
+        try:
+            data = _loads(request.get_data(cache=False) or b"{}") or {}
+        except Exception:
+            data = None
+        if not isinstance(data, dict):
+            return jsonify({"ok": False, "error": "请求体不是合法 JSON"}), 400
+    raw_resume = truncate(data.get("resume_text",""), MAX_TEXT_CHARS)
+
+    # 便宜的检查放最前面：key/空文本/过短先拒，regex 清洗与哈希只为合法输入买单
+    if not LLM_API_KEY:
+        return jsonify({"ok": False, "error": "未配置 LLM API key"}), 500
+    if not raw_resume.strip():
+        return jsonify({"ok": False, "error": "请粘贴简历文本或上传文件"}), 400
+    if is_text_too_short(raw_resume):
+        return jsonify({"ok": False, "error": "简历文本过短（≥500 中文字符或 ≥300 英文词）"}), 400
+
+    resume_text     = compress_context(raw_resume, 9000)
+    job_description = compress_context(truncate(data.get("job_description",""), MAX_JD_CHARS), 6000)
+    target_title    = clean_text(data.get("target_title",""))
+    target_location = clean_text(data.get("target_location",""))
+    target_industry = clean_text(data.get("target_industry",""))
+    mode = (data.get("model") or "").strip().lower()
+
+    if mode in ("speed","fast","balanced"):
+        # 收紧预算时同样保头保尾（clean_text 对已清洗文本走快路径，几乎零开销）
+        resume_text = compress_context(resume_text, 6500)
+        job_description = compress_context(job_description, 4500)
+
+    # 预分析对 (resume, jd) 是确定性的，按内容哈希记忆化
+    pk = hashlib.blake2b((resume_text + "\x00" + job_description).encode(),
+                         digest_size=16).hexdigest()
+    pre = pre_cache.get(pk)
+    if pre is None:
+        pre = quick_pre_analyze(resume_text, job_description)
+        pre_cache.set(pk, pre)
+    has_jd = bool(job_description)
+
+    base_user = {
+        "resume_text": resume_text,
+        "job_description": job_description,
+        "target_title": target_title,
+        "target_location": target_location,
+        "target_industry": target_industry,
+        "pre_analysis": pre
     }
 
-    phase1 = ["summary_highlights","improvements","career_diagnosis","career_level"]
-    phase2 = ["personalized_strategy","interview","salary"]
-    if has_jd: phase2.append("ats")
+    # 依赖图调度：只有 strategy/interview 真正依赖 diagnosis+level；
+    # salary 和 ats 没有前置，和第一阶段一起起跑，不再被阶段栅栏拦住
+    no_dep = ["summary_highlights","improvements","career_diagnosis","career_level"]
+    skipped = []
+    # 没有目标职位/城市时薪酬估算只剩套话，这次调用直接省掉；跳过名单随 done 帧告知前端
+    if target_title or target_location:
+        no_dep.append("salary")
+    else:
+        skipped.append("salary")
+    if has_jd:
+        no_dep.append("ats")
+    else:
+        skipped.append("ats")
+    dependents = ["personalized_strategy","interview"]
+    _DEP_KEYS = {"career_diagnosis","career_level"}
 
-    qout = queue.Queue()
+    # 有界队列：消费端（浏览器）卡住时完成帧不再无限堆积在内存里
+    qout = queue.Queue(maxsize=32)
     phase1_results = {}
 
-    def run_section(section, extra_ctx=None):
-        ck_raw = {"base": base_user, "sec": section, "mode": mode, "extra": extra_ctx}
-        ck = hashlib.sha256(json.dumps(ck_raw, ensure_ascii=False).encode()).hexdigest()
-        cached = cache.get(ck)
+    # 整包 base_user（含全文简历）只序列化一次，各 section 直接复用同一字符串。
+    # 大块上下文放在首条 system 消息、逐字节一致：各 section 调用共享同一前缀，
+    # 供应商侧 KV/前缀缓存可以命中，prefill 只计一次
+    base_user_json = _dumps(base_user)
+    context_msg = {"role": "system",
+                   "content": f'你是"{BRAND_NAME}"的资深猎头。候选人资料与预分析（JSON）如下：\n' + base_user_json}
+    # 输入整包的摘要算一次，各 section 的缓存键只在其上追加自己的小差异。
+    # 直接哈希原始字段（\x00 分隔）：pre_analysis 由 resume+JD 决定，无需参与，
+    # 也就不依赖 JSON 序列化的键序
+    base_digest = hashlib.blake2b(
+        "\x00".join((resume_text, job_description, target_title,
+                     target_location, target_industry, mode)).encode(),
+        digest_size=16).digest()
+
+    # salary 只看目标画像+年限信号，整份简历对它是纯 prefill 浪费；
+    # 代价是这一路脱离共享前缀，但省下的十几 KB 输入远大于一次前缀缓存命中
+    salary_ctx_msg = {"role": "system",
+                      "content": f'你是"{BRAND_NAME}"的资深猎头。候选人画像（JSON）如下：\n' + _dumps({
+                          "target_title": target_title,
+                          "target_location": target_location,
+                          "target_industry": target_industry,
+                          "years_span_estimate": pre.get("years_span_estimate", 0),
+                          "anchor_min_level": pre.get("anchor_min_level", "-")})}
+
+    dropped = set()  # 投递超时被丢掉的 section，streamer 据此补账，避免 need 永不清空
+
+    def _put(item):
+        # 最多等 30s：客户端死掉时放弃投递、释放工作线程，而不是永远挂在 put 上
+        try:
+            qout.put(item, timeout=30)
+        except queue.Full:
+            if "delta" not in item:
+                dropped.add(item["section"])
+
+    def run_section(section, extra_ctx=None, extra_suffix=None):
+        # 缓存键不需要抗碰撞攻击：blake2b 比 sha256 快得多，16 字节摘要足够
+        h = hashlib.blake2b(base_digest, digest_size=16)
+        h.update(section.encode())
+        if extra_ctx:
+            h.update(b"\x00"); h.update(_dumps(extra_ctx).encode())
+        ck = h.hexdigest()
+        cached = cache_get(ck)
         if cached is not None:
-            qout.put({"section": section, "data": cached}); return
+            obj, ser = cached
+            _put({"section": section, "data": obj, "_ser": ser}); return
+
+        with _inflight_lock:
+            ev = _inflight.get(ck)
+            leader = ev is None
+            if leader:
+                ev = _inflight[ck] = threading.Event()
+        if not leader:
+            # 跟随者：等领跑者写完缓存；失败/超时则退化为自己调一次
+            ev.wait(SECTION_TIMEOUT)
+            cached = cache_get(ck)
+            if cached is not None:
+                obj, ser = cached
+                _put({"section": section, "data": obj, "_ser": ser}); return
 
-        user_payload = dict(base_user)
-        if extra_ctx: user_payload["prior_findings"] = extra_ctx
+        # 变动部分（section 指令 + 先行结论）放末尾的 user 消息，保持共享前缀稳定
+        user_content = PROMPTS[section]
+        if extra_ctx:
+            if extra_suffix is None:
+                extra_suffix = "\n\n[prior_findings]\n" + _dumps(extra_ctx)
+            user_content += extra_suffix
 
-        messages=[{"role":"system","content":prompts[section]},
-                  {"role":"user","content":json.dumps(user_payload,ensure_ascii=False)}]
+        messages=[salary_ctx_msg if section == "salary" else context_msg,
+                  {"role":"user","content":user_content}]
         sec_model, sec_tokens = model_for(section, mode)
         payload = make_payload(messages, model=sec_model, max_tokens=sec_tokens)
 
+        # 增量 token 合批下发：每 ~0.3s 或攒够一批推一帧 delta，前端即见即渲染
+        pending = []
+        last_emit = [0.0]
+        def _on_delta(d):
+            pending.append(d)
+            now = time.time()
+            if now - last_emit[0] >= 0.3:
+                # 增量帧可丢：队列满说明消费端跟不上，保最终帧就够
+                try:
+                    qout.put_nowait({"section": section, "delta": "".join(pending)})
+                    pending.clear(); last_emit[0] = now
+                except queue.Full:
+                    pass
+
         try:
-            with ThreadPoolExecutor(max_workers=1) as inner:
-                fut = inner.submit(lambda: call_llm(payload, json_mode=True))
-                raw = fut.result(timeout=SECTION_TIMEOUT)
+            # 截止时间交给 requests 的 read timeout 执行，不再为此每个 section 起一个一次性线程池
+            if LLM_STREAM:
+                raw = call_llm_stream(payload, on_delta=_on_delta, read_timeout=SECTION_TIMEOUT)
+            else:
+                raw = call_llm(payload, json_mode=True, read_timeout=SECTION_TIMEOUT)
             try:
                 obj = _extract_json(raw)
             except Exception:
@@ -385,41 +952,79 @@ def optimize_stream():
                         f"（锚点下限：{a_min}）")
                     obj["career_level_analysis"]["level"] = a_min
 
-            cache.set(ck, obj)
-            qout.put({"section": section, "data": obj})
+            # 连同序列化结果一起缓存：命中时直接复用字符串，省掉整个 dict→JSON 的重复编码
+            item = {"section": section, "data": obj}
+            ser = _dumps_b(item)
+            cache_set(ck, (obj, ser))
+            item["_ser"] = ser
+            _put(item)
         except Exception as e:
-            qout.put({"section": section, "error": str(e)})
+            _put({"section": section, "error": str(e)})
+        finally:
+            if leader:
+                with _inflight_lock:
+                    _inflight.pop(ck, None)
+                ev.set()
 
     def streamer():
-        yield "retry: 1500\n"
-        yield 'data: {"section":"boot","data":{"msg":"引擎已启动，正在读取与你的简历做对齐…"}}\n\n'
-
-        with ThreadPoolExecutor(max_workers=min(4,len(phase1))) as ex1:
-            for sec in phase1: ex1.submit(run_section, sec)
-
-        need1=set(phase1); last_beat=time.time()
-        while need1:
-            if time.time()-last_beat>10: yield ": keep-alive\n\n"; last_beat=time.time()
-            item=qout.get()
-            yield f"data: {json.dumps(item,ensure_ascii=False)}\n\n"
-            need1.discard(item["section"])
-            if "error" not in item and item["section"] in ("career_diagnosis","career_level"):
-                phase1_results[item["section"]] = item["data"]
-
-        extra_ctx={"diagnosis":phase1_results.get("career_diagnosis",{}),
-                   "level":phase1_results.get("career_level",{})}
-        with ThreadPoolExecutor(max_workers=min(4,len(phase2))) as ex2:
-            for sec in phase2: ex2.submit(run_section, sec, extra_ctx)
-
-        need2=set(phase2)
-        while need2:
-            if time.time()-last_beat>10: yield ": keep-alive\n\n"; last_beat=time.time()
-            item=qout.get()
-            yield f"data: {json.dumps(item,ensure_ascii=False)}\n\n"
-            need2.discard(item["section"])
-
-        meta={"elapsed_ms":int((time.time()-t0)*1000),"mode":mode,"has_jd":has_jd,"pre_analysis":pre}
-        yield f"data: {json.dumps({'section':'done','data':{'meta':meta}},ensure_ascii=False)}\n\n"
+        # 整条流统一产出 bytes：JSON 由 orjson 直出 UTF-8，不再逐帧 str→bytes 再编码一次
+        yield b"retry: 1500\n"
+        yield 'data: {"section":"boot","data":{"msg":"引擎已启动，正在读取与你的简历做对齐…"}}\n\n'.encode()
+
+        # ATS 的关键词比对本地先算好，模型只做定性建议
+        ats_ctx = {"ats_local": ats_keyword_overlap(resume_text, job_description)} if has_jd else None
+
+        need = set(no_dep) | set(dependents)
+        submitted_deps = False
+        futs = [_POOL.submit(run_section, sec, ats_ctx if sec == "ats" else None)
+                for sec in no_dep]
+
+        def _submit_dependents():
+            nonlocal submitted_deps
+            # diagnosis+level 双双落定（含失败/掉帧）即提交 strategy/interview，不等其余无关 section
+            if submitted_deps or (_DEP_KEYS & need): return
+            submitted_deps = True
+            # 只带提炼后的结论（问题条目 + level/理由），不把上游整段输出再发一遍
+            _diag = phase1_results.get("career_diagnosis",{}).get("career_diagnosis",[])
+            _lvl  = phase1_results.get("career_level",{}).get("career_level_analysis",{})
+            extra_ctx={"diagnosis":[d.get("issue","") for d in _diag if isinstance(d,dict)][:6],
+                       "level":{"level":_lvl.get("level","-"),"reason":_lvl.get("reason","")}}
+            # 结论后缀序列化一次，依赖方共享同一字符串，不必每个 section 重复 dumps
+            extra_suffix = "\n\n[prior_findings]\n" + _dumps(extra_ctx)
+            for sec in dependents:
+                futs.append(_POOL.submit(run_section, sec, extra_ctx, extra_suffix))
+
+        try:
+            while need:
+                # 投递超时被丢的帧也算落定：客户端卡 30s 后恢复时流才能正常收尾
+                while dropped:
+                    sec = dropped.pop()
+                    if sec in need:
+                        need.discard(sec)
+                        yield b"data: " + _dumps_b({"section": sec, "error": "客户端接收过慢，该节结果已丢弃"}) + b"\n\n"
+                _submit_dependents()
+                if not need: break
+                # 用 get 超时驱动心跳：qout.get() 阻塞期间也能按时发注释帧，
+                # 不会因为某个 section 慢就让中间层把空闲连接掐掉
+                try:
+                    item=qout.get(timeout=10)
+                except queue.Empty:
+                    yield b": keep-alive\n\n"; continue
+                ser=item.pop("_ser",None)
+                yield b"data: " + (ser or _dumps_b(item)) + b"\n\n"
+                if "delta" in item: continue  # 增量帧不算 section 完成
+                need.discard(item["section"])
+                if "error" not in item and item["section"] in _DEP_KEYS:
+                    phase1_results[item["section"]] = item["data"]
+                _submit_dependents()
+
+            meta={"elapsed_ms":int((time.time()-t0)*1000),"mode":mode,"has_jd":has_jd,
+                  "skipped":skipped,"pre_analysis":pre}
+            yield b"data: " + _dumps_b({"section":"done","data":{"meta":meta}}) + b"\n\n"
+        finally:
+            # 客户端断开（GeneratorExit）时撤掉还没起跑的任务，别再为死连接花钱；
+            # 已在跑的调用由 read timeout 自行收尾
+            for f in futs: f.cancel()
 
     headers={"Content-Type":"text/event-stream; charset=utf-8",
              "Cache-Control":"no-cache","X-Accel-Buffering":"no"}
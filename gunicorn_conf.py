@@ -0,0 +1,11 @@
+import multiprocessing
+import os
+
+# SSE 长连接用 gevent 协作式并发：一个 worker 就能挂上千条流，
+# 不再是"一个线程陪一条连接等 LLM"。gunicorn 的 gevent worker 会自动打 monkey-patch。
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "600"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+bind = "0.0.0.0:" + os.getenv("PORT", "10000")